@@ -1,135 +1,226 @@
 import streamlit as st
 import pandas as pd
 import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from io import BytesIO
-from pypdf import PdfReader
+from itertools import islice
+import fitz  # PyMuPDF
+import pyarrow as pa
+import pyarrow.csv as pacsv
 
 # --- Core Utility Functions ---
 
-def extract_text_from_pdf(uploaded_file):
-    """Extracts raw text content from a PDF file object."""
+# One fused pattern classifies a line in a single regex-engine pass: either an
+# employee name header (Lastname, Firstname ...) or a payroll data row (a date
+# at the start of the line followed by at least two currency values). The row
+# alternative captures the fields directly: the greedy gap before 'gross' plus
+# the no-further-currency lookahead after the final value pin 'gross' to the
+# second-to-last currency on the line (Gross Remuneration, before Nett Pay).
+LINE_RE = re.compile(
+    r"^[ \t]*(?P<name>[A-Z][a-z]+(?:-\s?[A-Z][a-z]+)?, [A-Z].*)$"
+    r"|^[ \t]*\"?(?P<date>\d{4}-\d{2}-\d{2})[^\n]*(?P<gross>R\s*[\d,]+\.\d{2})"
+    r"[^\n]*?R\s*[\d,]+\.\d{2}(?![^\n]*R\s*[\d,]+\.\d{2})[^\n]*$",
+    re.MULTILINE
+)
+
+# Optional: Intel Hyperscan compiles both line patterns into one DFA and
+# locates matching lines in a single pass over the page buffer, far faster
+# than Python's backtracking engine. It ships as a prebuilt wheel
+# (pip install hyperscan) but is not pure Python, so the parser silently
+# falls back to the plain re path when it is unavailable.
+try:
+    import hyperscan
+
+    _HS_DB = hyperscan.Database()
+    _HS_DB.compile(
+        expressions=[
+            rb"^[ \t]*[A-Z][a-z]+(?:-\s?[A-Z][a-z]+)?, [A-Z][^\n]*$",
+            rb"^[ \t]*\"?\d{4}-\d{2}-\d{2}[^\n]*?R\s*[\d,]+\.\d{2}[^\n]*R\s*[\d,]+\.\d{2}[^\n]*$",
+        ],
+        ids=[0, 1],
+        flags=[hyperscan.HS_FLAG_MULTILINE | hyperscan.HS_FLAG_SOM_LEFTMOST | hyperscan.HS_FLAG_UTF8] * 2,
+    )
+except ImportError:
+    _HS_DB = None
+
+def _iter_line_matches(page_text):
+    """Yields LINE_RE matches for one page's text, in document order.
+
+    With hyperscan installed, a single DFA scan pre-locates the handful of
+    matching lines and LINE_RE only runs on those (it is still needed for
+    its named groups, which hyperscan does not support). Without it, the
+    plain finditer pass scans the whole buffer.
+    """
+    if _HS_DB is None:
+        yield from LINE_RE.finditer(page_text)
+        return
+
+    page_bytes = page_text.encode('utf-8')
+    starts = set()
+
+    def on_match(pat_id, start, end, flags, context=None):
+        # Hyperscan reports a match per viable end offset; both patterns are
+        # line-anchored, so dedupe on the line's start offset.
+        starts.add(start)
+
+    _HS_DB.scan(page_bytes, match_event_handler=on_match)
+
+    for start in sorted(starts):
+        newline = page_bytes.find(b'\n', start)
+        line = page_bytes[start:newline if newline != -1 else None].decode('utf-8')
+        m = LINE_RE.match(line)
+        if m:
+            yield m
+
+# Below this page count, process-pool startup costs more than it saves
+_PARALLEL_PAGE_THRESHOLD = 8
+
+def _extract_page_text(file_bytes, page_number):
+    """Worker: extracts one page's text from the PDF bytes (module-level so
+    it can be pickled into a process pool)."""
+    doc = fitz.open(stream=file_bytes, filetype="pdf")
+    try:
+        return doc.load_page(page_number).get_text("text")
+    finally:
+        doc.close()
+
+def extract_text_from_pdf(file_bytes):
+    """Yields the text of each page of a PDF given its raw bytes, one page
+    at a time.
+
+    Streaming keeps peak memory bounded to a single page's text instead of
+    the whole document, which matters for very large payroll reports.
+    """
     try:
-        pdf_reader = PdfReader(uploaded_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n\n"
-        return text
+        doc = fitz.open(stream=file_bytes, filetype="pdf")
+        try:
+            page_count = doc.page_count
+            if page_count <= _PARALLEL_PAGE_THRESHOLD:
+                for page in doc:
+                    yield page.get_text("text")
+                return
+        finally:
+            doc.close()
+
+        # Multi-page report: extraction is embarrassingly parallel across
+        # pages, so farm them out to worker processes and yield the results
+        # back in page order.
+        with ProcessPoolExecutor() as executor:
+            yield from executor.map(
+                partial(_extract_page_text, file_bytes),
+                range(page_count),
+                chunksize=4
+            )
     except Exception as e:
         st.error(f"Error reading PDF: {e}")
-        return None
 
-def parse_payroll_data(raw_text):
+def parse_payroll_data(page_iter):
     """
-    Parses the raw text to extract Employee Name, Date, and Gross Remuneration,
-    using a flexible pattern matching approach to handle variations.
+    Parses an iterable of page texts to extract Employee Name, Date, and
+    Gross Remuneration, using a flexible pattern matching approach to
+    handle variations.
     """
-    if not raw_text:
-        return pd.DataFrame()
+    # Accumulate parallel per-column lists rather than a dict per row; the
+    # DataFrame is columnar anyway, so this skips ~3N dict allocations and
+    # the row-to-column reshape at construction time.
+    names_col, dates_col, gross_col = [], [], []
+    current_employee = "Unknown Employee"
 
-    # Regex for Employee Name (Assuming names follow the pattern: Lastname, Firstname MiddleName)
-    name_pattern = re.compile(r"^([A-Z][a-z]+(?:-\s?[A-Z][a-z]+)?, [A-Z].*)$", re.MULTILINE)
+    # Scan each page buffer in a single MULTILINE finditer pass instead of
+    # splitting into lines and dispatching per line in Python. Matches come
+    # back in document order, so the current-employee state still walks
+    # correctly across name headers and data rows.
+    for page_text in page_iter:
+        for m in _iter_line_matches(page_text):
+            # 1. Employee Name header. Interned: the same ~dozens of names
+            # repeat across hundreds of rows, so keep one string object each.
+            if m.lastgroup == 'name':
+                current_employee = sys.intern(m.group('name').strip())
+                continue
 
-    # General Date Pattern (YYYY-MM-DD)
-    date_regex = re.compile(r'\d{4}-\d{2}-\d{2}')
-    
-    # Currency Pattern (R X,XXX.XX)
-    currency_regex = re.compile(r"R\s*[\d,]+\.\d{2}")
+            # 2. Payroll data row - the pattern already proved the shape and
+            # captured the fields, so no cleanup or re-scan is needed
+            names_col.append(current_employee)
+            dates_col.append(m.group('date'))
+            gross_col.append(m.group('gross'))
 
-    all_data = []
-    current_employee = "Unknown Employee"
-    
-    lines = raw_text.split('\n')
-    
-    # Process lines, aggregating data
-    for line in lines:
-        line = line.strip()
-        
-        # 1. Check for Employee Name
-        name_match = name_pattern.match(line)
-        if name_match:
-            current_employee = name_match.group(1).strip()
-            continue
-
-        # 2. Check for Data Line using flexible patterns
-        
-        # A line must start with a date...
-        date_match = date_regex.match(line)
-        
-        # ...AND it must contain at least two currency values (Gross Remuneration and Nett Pay)
-        currency_values = currency_regex.findall(line)
-        
-        if date_match and len(currency_values) >= 2:
-            # This line is a potential payroll data record. We now clean it.
-            
-            # Remove any enclosing quotes and internal newlines for simpler processing
-            # This handles both the "quoted, comma-separated" and "simple space-separated" formats
-            cleaned_line = line.replace('"', '').replace('\n', '').strip()
-            
-            # Re-find currency values from the cleaned line for reliability
-            currency_values = currency_regex.findall(cleaned_line)
-            
-            # The date is the first item that matches the date pattern at the start of the line
-            date = date_match.group(0)
-            
-            # Gross Remuneration is reliably the second to last currency value (before Nett Pay)
-            if len(currency_values) >= 2:
-                gross_remuneration = currency_values[-2]
-                
-                all_data.append({
-                    "Employee Name": current_employee,
-                    "Date": date,
-                    "Gross Remuneration": gross_remuneration
-                })
-        
-    # Create DataFrame
-    df = pd.DataFrame(all_data)
+    # Create DataFrame once from the column lists
+    df = pd.DataFrame({
+        "Employee Name": names_col,
+        "Date": dates_col,
+        "Gross Remuneration": gross_col
+    })
 
     if df.empty:
         return df
 
+    # Categorical encoding stores each repeated name once plus small integer
+    # codes, and makes the groupbys below cheaper than object-dtype grouping
+    df['Employee Name'] = df['Employee Name'].astype('category')
+
     # --- Data Cleaning and Aggregation ---
-    
-    # Convert 'Gross Remuneration' to numeric for calculation
-    # Remove 'R', commas, and convert to float
-    def clean_currency(value):
-        try:
-            return float(value.replace('R', '').replace(',', '').strip())
-        except:
-            return 0.0
 
-    df['Gross Remuneration Value'] = df['Gross Remuneration'].apply(clean_currency)
+    # Convert 'Gross Remuneration' to numeric for calculation using pandas'
+    # vectorized string ops (runs in C) rather than a per-row Python function.
+    # Remove 'R', commas, and convert to float
+    df['Gross Remuneration Value'] = (
+        df['Gross Remuneration']
+        .str.replace('R', '', regex=False)
+        .str.replace(',', '', regex=False)
+        .str.strip()
+        .astype('float64')
+    )
 
     # Calculate Totals
-    totals = df.groupby('Employee Name')['Gross Remuneration Value'].sum().reset_index()
+    totals = df.groupby('Employee Name', observed=True)['Gross Remuneration Value'].sum().reset_index()
     totals.columns = ['Employee Name', 'Total Gross Remuneration']
     
-    # Format the total column back to currency
-    totals['Total Gross Remuneration'] = totals['Total Gross Remuneration'].map('R {:,.2f}'.format)
+    # Format the total column back to currency (the prefix concat is vectorized)
+    totals['Total Gross Remuneration'] = 'R ' + totals['Total Gross Remuneration'].map('{:,.2f}'.format)
 
     # Prepare Final Output
     final_df = df[['Employee Name', 'Date', 'Gross Remuneration']].copy()
 
-    # Append totals to the end of each employee's records
-    final_records = []
-    
-    for name in final_df['Employee Name'].unique():
-        employee_records = final_df[final_df['Employee Name'] == name]
-        total_row = totals[totals['Employee Name'] == name].iloc[0]
-        
-        final_records.extend(employee_records.to_dict('records'))
-        
-        final_records.append({
-            "Employee Name": f"TOTAL for {name}",
-            "Date": "",
-            "Gross Remuneration": total_row['Total Gross Remuneration']
-        })
+    # Append totals to the end of each employee's records. A single groupby
+    # pass replaces the per-employee boolean-mask scans of the full frame.
+    totals_dict = totals.set_index('Employee Name')['Total Gross Remuneration'].to_dict()
+
+    # Interleave each employee's subframe with a one-row TOTAL frame and
+    # concatenate once, staying columnar instead of spilling every value
+    # into Python lists and rebuilding from scratch
+    pieces = []
+
+    for name, employee_records in final_df.groupby('Employee Name', sort=False, observed=True):
+        pieces.append(employee_records)
+        pieces.append(pd.DataFrame({
+            "Employee Name": [f"TOTAL for {name}"],
+            "Date": [""],
+            "Gross Remuneration": [totals_dict[name]]
+        }))
 
-    return pd.DataFrame(final_records)
+    return pd.concat(pieces, ignore_index=True)
+
+@st.cache_data(show_spinner=False)
+def load_payroll_data(file_bytes):
+    """Extracts and parses an uploaded PDF's bytes into the summary DataFrame.
+
+    Cached on the raw file bytes, so sidebar toggles and other Streamlit
+    reruns reuse the parsed result instead of re-reading the PDF.
+    """
+    return parse_payroll_data(extract_text_from_pdf(file_bytes))
 
 @st.cache_data
 def convert_df_to_csv(df):
-    """Converts the DataFrame to a CSV string for download."""
-    return df.to_csv(index=False).encode('utf-8')
+    """Converts the DataFrame to CSV bytes for download.
+
+    Arrow's writer emits UTF-8 bytes straight from columnar buffers,
+    skipping pandas' Python-level writer and the str -> bytes re-encode.
+    """
+    buf = BytesIO()
+    pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buf)
+    return buf.getvalue()
 
 # --- Streamlit Application Layout ---
 
@@ -153,37 +244,41 @@ uploaded_file = st.file_uploader(
 )
 
 if uploaded_file is not None:
+    # Read the upload once; the same bytes feed the cache key, the parser,
+    # and the debug preview below
+    pdf_bytes = uploaded_file.getvalue()
+
     # Use st.spinner for a better UX while processing
     with st.spinner("Processing PDF and extracting data..."):
-        # 1. Extract Text
-        pdf_text = extract_text_from_pdf(uploaded_file)
-        
-        if pdf_text:
-            # 2. Parse Data
-            result_df = parse_payroll_data(pdf_text)
-            
-            if not result_df.empty:
-                st.success("Extraction Complete! Data Ready for Review and Download.")
-                
-                # 3. Display Data
-                st.subheader("Extracted and Summarized Data")
-                st.dataframe(result_df, hide_index=True)
-                
-                # 4. Download Button
-                csv_data = convert_df_to_csv(result_df)
-                
+        # 1. Extract and Parse Data (cached on the file bytes)
+        result_df = load_payroll_data(pdf_bytes)
+
+        if not result_df.empty:
+            st.success("Extraction Complete! Data Ready for Review and Download.")
+
+            # 2. Display Data
+            st.subheader("Extracted and Summarized Data")
+            st.dataframe(result_df, hide_index=True)
+
+            # 3. Download Button. CSV bytes are only generated once the user
+            # asks for them, instead of on every upload/rerun; after that,
+            # the cached converter keeps subsequent reruns cheap.
+            if st.button("Prepare CSV for Download"):
+                st.session_state['csv_ready'] = True
+
+            if st.session_state.get('csv_ready'):
                 st.download_button(
                     label="Download Extracted Payroll Data as CSV",
-                    data=csv_data,
+                    data=convert_df_to_csv(result_df),
                     file_name='payroll_summary.csv',
                     mime='text/csv',
                     type="primary"
                 )
-                
-                st.markdown("---")
-                st.info("The CSV includes the date records and a final 'TOTAL' row for each employee.")
-            else:
-                st.error("Could not find any matching payroll records. The structure may have changed significantly. Try checking the 'Show Raw Extracted Text' box for debugging.")
+
+            st.markdown("---")
+            st.info("The CSV includes the date records and a final 'TOTAL' row for each employee.")
+        else:
+            st.error("Could not find any matching payroll records. The structure may have changed significantly. Try checking the 'Show Raw Extracted Text' box for debugging.")
         
 # Instructions for Deployment
 st.sidebar.header("Deployment Information")
@@ -195,13 +290,16 @@ This is a Streamlit application, which is ideal for free deployment.
     ```text
     streamlit
     pandas
-    pypdf
+    PyMuPDF
+    pyarrow
     ```
 3.  **Upload to GitHub:** Create a new repository and upload `app.py` and `requirements.txt`.
 4.  **Deploy:** Go to the [Streamlit Community Cloud](https://share.streamlit.io/) website, log in, and connect it to your GitHub repository to deploy the app for free.
 """)
 
 # Show raw text toggle (useful for debugging parsing)
-if uploaded_file is not None and st.sidebar.checkbox("Show Raw Extracted Text (For Debugging)"):
+if uploaded_file is not None and st.sidebar.checkbox("Show Raw Extracted Text (For Debugging)", key='debug'):
     st.sidebar.subheader("Raw Text Output")
-    st.sidebar.code(pdf_text[:10000]) # Limit output size
+    # Buffer only the first few pages rather than the whole document
+    preview = "\n".join(islice(extract_text_from_pdf(pdf_bytes), 10))
+    st.sidebar.code(preview[:10000]) # Limit output size